@@ -1,97 +1,27 @@
 import streamlit as st
-import pandas as pd
-import joblib
+import numpy as np
 from datetime import datetime
-import holidays
-import requests
-import pytz
-import folium
-from streamlit_folium import st_folium
-from urllib.parse import quote
+from features import IST, time_features
+from services import (
+    GWALIOR_LAT, GWALIOR_LON, get_executor, load_model, predict_seconds, load_gazetteer, fetch_live_weather, get_live_weather,
+    fetch_location_options, get_location_options, fetch_route, get_route_details,
+)
 
 st.set_page_config(page_title="Gwalior Traffic Forecaster", page_icon="🚗", layout="wide")
 
 # --- CONFIGURATION & MODEL LOADING ---
-MODEL_PATH = "models/traffic_model.joblib"
+MODEL_PATH = "models/traffic_model.onnx"
 GAZETTEER_PATH = "data/gwalior_locations.csv"
-GWALIOR_LAT = 26.2183
-GWALIOR_LON = 78.1828
-IST = pytz.timezone('Asia/Kolkata')
-indian_holidays = holidays.India(state='MP', years=datetime.now().year)
-
-MODEL_COLUMNS = [
-    'base_travel_time_seconds', 'day_of_week', 'hour_of_day',
-    'is_market_closed', 'is_holiday', 'weather',
-    'route_name_CityCenter-to-Palace', 'route_name_Fort-to-Station',
-    'route_name_Highway-Bypass', 'route_name_Mall-to-IIITM',
-    'route_name_Thatipur-to-Morar'
-]
-
-@st.cache_resource
-def load_model(path):
-    return joblib.load(path)
-
-@st.cache_data
-def load_gazetteer(path):
-    try:
-        df = pd.read_csv(path)
-        return {row['alias'].upper(): row['official_search_query'] for index, row in df.iterrows()}
-    except FileNotFoundError:
-        return {} 
+MODEL_ROUTE = 'Thatipur-to-Morar'
+TRAVEL_MODES = ('car', 'motorcycle', 'pedestrian')
+# Free-flow time is rounded to this many seconds before prediction so near-identical routes share a cache entry;
+# +/-7 s of input is well below the whole minutes shown to the user
+BASE_TIME_STEP = 15
 
 model = load_model(MODEL_PATH)
 known_locations = load_gazetteer(GAZETTEER_PATH)
 
-# --- LIVE DATA API FUNCTIONS ---
-
-@st.cache_data(ttl=600)
-def get_live_weather(api_key, lat, lon):
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}"
-    try:
-        response = requests.get(url).json()
-        weather_main = response['weather'][0]['main']
-        if 'Rain' in weather_main or 'Drizzle' in weather_main or 'Thunderstorm' in weather_main: return 2, f"Rainy 🌧️ ({weather_main})"
-        elif 'Clouds' in weather_main: return 1, f"Cloudy ☁️ ({weather_main})"
-        else: return 0, f"Clear ☀️ ({weather_main})"
-    except Exception: return 0, "Clear ☀️ (default)"
-
-@st.cache_data(ttl=3600)
-def get_location_options(api_key, location_name, pincode=None):
-    search_query = f"{location_name}, Gwalior, India"
-    if pincode and len(pincode) == 6 and pincode.isdigit():
-        search_query = f"{location_name}, {pincode}, Gwalior, India"
-    encoded_location = quote(search_query)
-    url = f"https://api.tomtom.com/search/2/search/{encoded_location}.json?key={api_key}&lat={GWALIOR_LAT}&lon={GWALIOR_LON}&limit=5"
-    try:
-        response = requests.get(url).json()
-        if response and response['results']:
-            return {res['address']['freeformAddress']: f"{res['position']['lat']},{res['position']['lon']}" for res in response['results']}
-    except Exception as e:
-        st.error(f"Error searching for location '{location_name}': {e}")
-    return {}
-
-@st.cache_data(ttl=60)
-def get_route_details(api_key, start_coords, end_coords, mode='car'):
-    url = f"https://api.tomtom.com/routing/1/calculateRoute/{start_coords}:{end_coords}/json?key={api_key}&travelMode={mode}&traffic=true&routeType=fastest&routeRepresentation=polyline"
-    try:
-        response = requests.get(url).json()
-        if 'routes' in response and len(response['routes']) > 0:
-            route = response['routes'][0]
-            summary = route['summary']
-            
-            # --- FIX: Gracefully handle missing traffic data during off-peak hours ---
-            live_time = summary.get('trafficTravelTimeInSeconds', summary.get('travelTimeInSeconds'))
-            base_time = summary.get('travelTimeInSeconds')
-            
-            points = route['legs'][0]['points']
-            route_geometry = [[p['latitude'], p['longitude']] for p in points]
-            
-            if live_time and base_time:
-                return live_time, base_time, route_geometry
-    except Exception as e:
-        # This will now display the actual API error on the screen for better debugging
-        st.error(f"Error calculating route for '{mode}': {e}")
-    return None, None, None
+# --- TRAFFIC STATUS ---
 
 def get_traffic_status(predicted_time, base_time):
     if not base_time or base_time == 0: return "Unknown", "⚪"
@@ -100,6 +30,45 @@ def get_traffic_status(predicted_time, base_time):
     elif 1.2 <= ratio < 1.6: return "Moderate Traffic", "🟡"
     else: return "Heavy Traffic", "🔴"
 
+# --- ROUTE MAP ---
+
+MAP_PATH_GRID_DEG = 1e-4  # ~11 m; finer detail than this is invisible at city zoom
+
+def compact_path(route_geometry, grid=MAP_PATH_GRID_DEG):
+    # The whole path is serialized into the deck.gl JSON, so drop consecutive vertices that fall in the same
+    # grid cell as their predecessor; the first and last points are always kept.
+    if len(route_geometry) < 3:
+        return route_geometry
+    cells = np.floor(route_geometry / grid)
+    keep = np.empty(len(route_geometry), dtype=bool)
+    keep[0] = keep[-1] = True
+    keep[1:-1] = np.any(cells[1:-1] != cells[:-2], axis=1)
+    return route_geometry[keep]
+
+# Keyed on live (traffic-aware) geometry, so bound it: every reroute would otherwise keep another Deck alive
+@st.cache_resource(show_spinner=False, max_entries=32, ttl=600)
+def build_route_map(route_geometry, start_coords, end_coords):
+    # Imported on first use so the search/confirm stages don't pay for it
+    import pydeck as pdk
+    (start_lat, start_lon), (end_lat, end_lon) = start_coords, end_coords
+    path = compact_path(route_geometry)[:, ::-1].tolist()  # deck.gl wants [lon, lat]
+    route_layer = pdk.Layer('PathLayer', data=[{'path': path}], get_path='path', get_color=[0, 85, 255, 204],
+                            get_width=5, width_min_pixels=7, cap_rounded=True, joint_rounded=True)
+    endpoints = [
+        {'position': [start_lon, start_lat], 'color': [34, 139, 34]},
+        {'position': [end_lon, end_lat], 'color': [220, 20, 60]},
+    ]
+    marker_layer = pdk.Layer('ScatterplotLayer', data=endpoints, get_position='position', get_fill_color='color',
+                             get_radius=40, radius_min_pixels=9, stroked=True, get_line_color=[255, 255, 255], line_width_min_pixels=2)
+    view_state = pdk.data_utils.compute_view(path + [e['position'] for e in endpoints])
+    return pdk.Deck(layers=[route_layer, marker_layer], initial_view_state=view_state,
+                    map_provider='carto', map_style=pdk.map_styles.ROAD, tooltip=False)
+
+def render_route_map(route_geometry, start_coords, end_coords):
+    # Reuses the cached Deck, so reruns skip building the layers; st.pydeck_chart still serializes it each time
+    st.subheader("Route Map")
+    st.pydeck_chart(build_route_map(route_geometry, start_coords, end_coords), height=500)
+
 # --- STREAMLIT APP INTERFACE ---
 
 st.title("🚗 Gwalior Smart Traffic Forecaster")
@@ -126,10 +95,17 @@ if st.session_state.stage == 'search':
         destination_pincode = st.text_input("Pincode (Optional)", "", max_chars=6)
     if st.button("Find Locations", use_container_width=True, disabled=(not TOMTOM_API_KEY)):
         with st.spinner("Searching for locations..."):
-            origin_query = known_locations.get(origin.upper(), origin)
-            destination_query = known_locations.get(destination.upper(), destination)
-            st.session_state.origin_options = get_location_options(TOMTOM_API_KEY, origin_query, origin_pincode)
-            st.session_state.destination_options = get_location_options(TOMTOM_API_KEY, destination_query, destination_pincode)
+            origin_query = known_locations.get(origin.strip().upper(), origin)
+            destination_query = known_locations.get(destination.strip().upper(), destination)
+            # Fold case and whitespace so "kailash nagar" and "Kailash Nagar " share one cached lookup
+            queries = tuple((' '.join(name.split()).lower(), pincode.strip())
+                            for name, pincode in ((origin_query, origin_pincode), (destination_query, destination_pincode)))
+            executor = get_executor()
+            search_future = executor.submit(fetch_location_options, TOMTOM_API_KEY, queries)
+            # Weather doesn't depend on the locations; fetch it now so it's already cached when Predict is clicked
+            executor.submit(fetch_live_weather, WEATHER_API_KEY, GWALIOR_LAT, GWALIOR_LON)
+            st.session_state.origin_options = get_location_options(search_future, 0, origin_query)
+            st.session_state.destination_options = get_location_options(search_future, 1, destination_query)
             st.session_state.user_inputs = {'origin': origin, 'destination': destination}
             if st.session_state.origin_options and st.session_state.destination_options:
                 st.session_state.stage = 'confirm'
@@ -144,10 +120,16 @@ if st.session_state.stage == 'confirm':
     st.write("**Select the correct end location:**")
     confirmed_destination_address = st.radio("Destination Options", list(st.session_state.destination_options.keys()), label_visibility="collapsed")
     if st.button("Get Forecasts", use_container_width=True):
-        st.session_state.start_coords = st.session_state.origin_options[confirmed_origin_address]
-        st.session_state.end_coords = st.session_state.destination_options[confirmed_destination_address]
-        st.session_state.stage = 'predict'
-        st.rerun()
+        start_coords = st.session_state.origin_options[confirmed_origin_address]
+        end_coords = st.session_state.destination_options[confirmed_destination_address]
+        if start_coords == end_coords:
+            # Nothing to route or predict; skip the API calls
+            st.info("Start and end are the same place. Please pick two different locations.")
+        else:
+            st.session_state.start_coords = start_coords
+            st.session_state.end_coords = end_coords
+            st.session_state.stage = 'predict'
+            st.rerun()
     if st.button("Start Over", use_container_width=True):
         st.session_state.stage = 'search'
         if 'results' in st.session_state: del st.session_state['results']
@@ -159,24 +141,25 @@ if st.session_state.stage == 'predict':
     
     results = {}
     now_ist = datetime.now(IST)
-    weather_code, weather_desc = get_live_weather(WEATHER_API_KEY, GWALIOR_LAT, GWALIOR_LON)
+
+    # Weather and all three routes are independent requests, so fire them together
+    executor = get_executor()
+    weather_future = executor.submit(fetch_live_weather, WEATHER_API_KEY, GWALIOR_LAT, GWALIOR_LON)
+    route_futures = {mode: executor.submit(fetch_route, TOMTOM_API_KEY, start_coords, end_coords, mode) for mode in TRAVEL_MODES}
+    weather_code, weather_desc = get_live_weather(weather_future)
     
-    live_car_time, base_time, route_geometry = get_route_details(TOMTOM_API_KEY, start_coords, end_coords, mode='car')
+    live_car_time, base_time, route_geometry = get_route_details(route_futures['car'], mode='car')
     if base_time:
-        prediction_df = pd.DataFrame(0, index=[0], columns=MODEL_COLUMNS)
-        prediction_df.loc[0, ['base_travel_time_seconds', 'day_of_week', 'hour_of_day']] = [base_time, now_ist.weekday(), now_ist.hour]
-        prediction_df.loc[0, 'is_market_closed'] = 1 if now_ist.weekday() == 1 else 0
-        prediction_df.loc[0, 'is_holiday'] = 1 if now_ist.date() in indian_holidays else 0
-        prediction_df.loc[0, 'weather'] = weather_code
-        prediction_df.loc[0, 'route_name_Thatipur-to-Morar'] = 1
-        predicted_seconds = model.predict(prediction_df)
-        results['car_ml'] = predicted_seconds[0] / 60
-        traffic_status_text, traffic_status_emoji = get_traffic_status(predicted_seconds[0], base_time)
+        day_of_week, hour_of_day, is_market_closed, is_holiday = time_features()
+        base_time_key = round(base_time / BASE_TIME_STEP) * BASE_TIME_STEP
+        predicted_seconds = predict_seconds(model, base_time_key, day_of_week, hour_of_day, is_market_closed, is_holiday, weather_code, MODEL_ROUTE)
+        results['car_ml'] = predicted_seconds / 60
+        traffic_status_text, traffic_status_emoji = get_traffic_status(predicted_seconds, base_time)
         results['traffic_status'] = f"{traffic_status_text} {traffic_status_emoji}"
     
-    moto_time, _, _ = get_route_details(TOMTOM_API_KEY, start_coords, end_coords, mode='motorcycle')
+    moto_time, _, _ = get_route_details(route_futures['motorcycle'], mode='motorcycle')
     if moto_time: results['motorcycle'] = moto_time / 60
-    walk_time, _, _ = get_route_details(TOMTOM_API_KEY, start_coords, end_coords, mode='pedestrian')
+    walk_time, _, _ = get_route_details(route_futures['pedestrian'], mode='pedestrian')
     if walk_time: results['pedestrian'] = walk_time / 60
     
     st.subheader("Your Route")
@@ -189,17 +172,8 @@ if st.session_state.stage == 'predict':
     with res_col4: st.metric(label="🚶 By Walking", value=f"{results.get('pedestrian', 0):.0f} min")
     st.info(f"**Live Conditions:** {now_ist.strftime('%I:%M %p, %A')}, {weather_desc}")
 
-    if route_geometry:
-        st.subheader("Route Map")
-        google_maps_tile = 'http://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}'
-        m = folium.Map(location=[GWALIOR_LAT, GWALIOR_LON], zoom_start=13, tiles=google_maps_tile, attr='Google')
-        folium.PolyLine(route_geometry, color="#0055FF", weight=7, opacity=0.8).add_to(m)
-        start_lat, start_lon = map(float, start_coords.split(','))
-        end_lat, end_lon = map(float, end_coords.split(','))
-        folium.Marker([start_lat, start_lon], icon=folium.Icon(color='green', icon='play')).add_to(m)
-        folium.Marker([end_lat, end_lon], icon=folium.Icon(color='red', icon='stop')).add_to(m)
-        m.fit_bounds([[start_lat, start_lon], [end_lat, end_lon]])
-        st_folium(m, width="100%", height=500, returned_objects=[])
+    if route_geometry is not None and len(route_geometry) > 0:
+        render_route_map(route_geometry, start_coords, end_coords)
 
     if st.button("New Search", use_container_width=True):
         st.session_state.stage = 'search'
@@ -0,0 +1,20 @@
+"""Export the trained LightGBM model to ONNX so app.py can serve it with onnxruntime.
+
+Run from the repository root after retraining:  python export_onnx.py
+The export-only dependencies are in requirements-export.txt; the app itself doesn't need them.
+"""
+import joblib
+from onnxmltools import convert_lightgbm
+from onnxmltools.convert.common.data_types import FloatTensorType
+
+JOBLIB_PATH = "models/traffic_model.joblib"
+ONNX_PATH = "models/traffic_model.onnx"
+
+if __name__ == "__main__":
+    model = joblib.load(JOBLIB_PATH)
+    # The app always scores exactly one row, so pin the input shape to (1, n_features)
+    initial_types = [('input', FloatTensorType([1, model.n_features_in_]))]
+    onnx_model = convert_lightgbm(model, initial_types=initial_types, target_opset=15)
+    with open(ONNX_PATH, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"Wrote {ONNX_PATH}")
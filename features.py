@@ -0,0 +1,69 @@
+"""Model feature construction.
+
+Kept out of app.py because Streamlit re-executes the app script on every
+rerun; module-level state here (lru caches, generated builder) lives for the
+whole process.
+"""
+import time
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+IST = ZoneInfo('Asia/Kolkata')
+MODEL_COLUMNS = (
+    'base_travel_time_seconds', 'day_of_week', 'hour_of_day',
+    'is_market_closed', 'is_holiday', 'weather',
+    'route_name_CityCenter-to-Palace', 'route_name_Fort-to-Station',
+    'route_name_Highway-Bypass', 'route_name_Mall-to-IIITM',
+    'route_name_Thatipur-to-Morar',
+)
+ROUTE_PREFIX = 'route_name_'
+COL_IDX = {name: i for i, name in enumerate(MODEL_COLUMNS)}
+SCALAR_FEATURES = tuple(name for name in MODEL_COLUMNS if not name.startswith(ROUTE_PREFIX))
+ROUTE_IDX = {name[len(ROUTE_PREFIX):]: i for i, name in enumerate(MODEL_COLUMNS) if name.startswith(ROUTE_PREFIX)}
+FEATURE_TEMPLATE = np.zeros((1, len(MODEL_COLUMNS)), dtype=np.float32)
+
+
+@lru_cache(maxsize=2)
+def _holiday_ordinals(year):
+    # Deferred until the first prediction; building the holidays calendar is not needed to render the search page.
+    # Keyed on the year so a long-running process rolls over; the window spans the neighbouring years either side.
+    import holidays
+    return frozenset(d.toordinal() for d in holidays.India(state='MP', years=range(year - 1, year + 2)).keys())
+
+
+@lru_cache(maxsize=64)
+def _time_features(minute_bucket):
+    now_ist = datetime.fromtimestamp(minute_bucket * 60, IST)
+    weekday = now_ist.weekday()
+    is_market_closed = 1 if weekday == 1 else 0
+    is_holiday = 1 if now_ist.toordinal() in _holiday_ordinals(now_ist.year) else 0
+    return weekday, now_ist.hour, is_market_closed, is_holiday
+
+
+def time_features():
+    """Return (day_of_week, hour_of_day, is_market_closed, is_holiday) for the current IST minute."""
+    return _time_features(int(time.time() // 60))
+
+
+def _compile_feature_builder():
+    # MODEL_COLUMNS is fixed, so bake every column position into straight-line stores once
+    # instead of resolving names on each prediction. Parameters are named after the columns.
+    stores = "\n".join(f"    x[0, {COL_IDX[name]}] = {name}" for name in SCALAR_FEATURES)
+    source = (
+        f"def build_features({', '.join(SCALAR_FEATURES)}, route_name):\n"
+        f"    x = _TEMPLATE.copy()\n"
+        f"{stores}\n"
+        f"    x[0, _ROUTE_IDX[route_name]] = 1\n"
+        f"    return x\n"
+    )
+    namespace = {'_TEMPLATE': FEATURE_TEMPLATE, '_ROUTE_IDX': ROUTE_IDX}
+    exec(source, namespace)
+    build = namespace['build_features']
+    build.__doc__ = "Return the (1, len(MODEL_COLUMNS)) float32 model input for one trip on `route_name`."
+    return build
+
+
+build_features = _compile_feature_builder()
@@ -0,0 +1,224 @@
+"""TomTom/OpenWeather API access and model/gazetteer loading, shared by the Streamlit UI."""
+import csv
+import streamlit as st
+import numpy as np
+import onnxruntime as ort
+import requests
+import requests_cache
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from urllib.parse import quote, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from features import FEATURE_TEMPLATE, build_features
+
+GWALIOR_LAT = 26.2183
+GWALIOR_LON = 78.1828
+# TomTom search endpoint for location lookups: 'fuzzy' also matches POIs/brands, 'geocode' only addresses
+SEARCH_MODE = 'fuzzy'
+SEARCH_ENDPOINTS = {'fuzzy': 'search', 'geocode': 'geocode'}
+# Search hits further than this from the Gwalior bias point are other places with the same name (metres)
+SEARCH_RADIUS_M = 50_000
+
+HTTP_TIMEOUT = (2, 5)  # (connect, read) seconds
+HTTP_MAX_WORKERS = 8
+HTTP_CACHE_PATH = "http_cache.sqlite"
+# Disk (L2) cache lifetimes in seconds, matching the st.cache_data TTLs in front of them
+HTTP_CACHE_EXPIRY = {
+    'api.tomtom.com/routing/*': 60,
+    'api.tomtom.com/search/*': 86400,
+    'api.openweathermap.org/*': 600,
+}
+
+# OpenWeather condition group (id // 100) -> (model weather code, display label). 800 is clear sky, 801-804 clouds.
+WEATHER_CLEAR = (0, "Clear ☀️")
+WEATHER_GROUPS = {
+    2: (2, "Rainy 🌧️"), 3: (2, "Rainy 🌧️"), 5: (2, "Rainy 🌧️"),
+    6: (2, "Snowy ❄️"), 7: (1, "Hazy 🌫️"), 8: (1, "Cloudy ☁️"),
+}
+
+# --- MODEL & GAZETTEER LOADING ---
+
+@st.cache_resource
+def load_model(path):
+    # ONNX export of models/traffic_model.joblib, see export_onnx.py.
+    # A single-row tree ensemble has nothing to parallelize, so skip ORT's per-core (spin-waiting) thread pools.
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+    # Warm-up run so the first user click doesn't pay for ORT's lazy allocations
+    session.run(None, {'input': FEATURE_TEMPLATE})
+    return session
+
+@lru_cache(maxsize=1024)
+def predict_seconds(model, base_travel_time_seconds, day_of_week, hour_of_day, is_market_closed, is_holiday, weather, route_name):
+    # The prediction is deterministic in these scalars, so repeat clicks are a dict hit. A plain lru_cache rather than
+    # st.cache_data: hashing the arguments there costs more than the ~10 µs ONNX run it would save.
+    features = build_features(base_travel_time_seconds, day_of_week, hour_of_day, is_market_closed, is_holiday, weather, route_name)
+    return float(model.run(None, {'input': features})[0].ravel()[0])
+
+@st.cache_data
+def load_gazetteer(path):
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            # '#' lines are section headers in the CSV, not aliases
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            return {row['alias'].upper(): row['official_search_query'] for row in rows
+                    if row['alias'] and row['official_search_query']}
+    except FileNotFoundError:
+        return {}
+
+# --- LIVE DATA API FUNCTIONS ---
+
+def _is_cacheable(response):
+    # The batch-search endpoint answers 200 even when individual items fail; don't keep those batches around
+    # (non-200 responses are already kept out by allowable_codes and reported by _fetch_json, so pass them through)
+    if response.status_code != 200 or '/search/2/batch/' not in response.url:
+        return True
+    try:
+        items = orjson.loads(response.content)['batchItems']
+        return all(item['statusCode'] == 200 for item in items)
+    except (orjson.JSONDecodeError, TypeError, KeyError):
+        return False
+
+@st.cache_resource
+def get_session():
+    # Shared keep-alive session so TLS connections are reused across API calls and reruns.
+    # Responses are also cached on disk by URL (and body, for batch-search POSTs), so restarts and other
+    # sessions skip repeat API calls. With REDIS_URL set (needs requirements-redis.txt) that cache is shared
+    # by every worker/replica instead of being one SQLite file per container.
+    redis_url = st.secrets.get("REDIS_URL", "")
+    if redis_url:
+        from redis import Redis
+        backend = requests_cache.RedisCache(connection=Redis.from_url(redis_url))
+    else:
+        backend = requests_cache.SQLiteCache(HTTP_CACHE_PATH)
+        # Expired rows are only replaced, never dropped, so sweep them once per process to keep the file bounded
+        backend.delete(expired=True)
+    session = requests_cache.CachedSession(backend=backend, allowable_methods=['GET', 'POST'],
+                                           urls_expire_after=HTTP_CACHE_EXPIRY, ignored_parameters=['key', 'appid'],
+                                           filter_fn=_is_cacheable)
+    # Route JSON compresses well; urllib3 decodes br transparently when brotli is installed
+    session.headers.update({'Accept-Encoding': 'gzip, br, deflate'})
+    # Short retries for dropped connections and transient 429/5xx; the batch-search POST is read-only, so it is safe to retry too
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET', 'POST'], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=HTTP_MAX_WORKERS, pool_maxsize=HTTP_MAX_WORKERS, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def get_executor():
+    # Process-wide pool for API fan-out; sized to the connection pool so every in-flight request gets a kept-alive socket
+    return ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS, thread_name_prefix="api")
+
+def _fetch_json(url, payload=None):
+    # Errors end up in st.error, and the URL carries the API key, so none of the messages raised here include it
+    session = get_session()
+    try:
+        if payload is None:
+            response = session.get(url, timeout=HTTP_TIMEOUT)
+        else:
+            response = session.post(url, data=orjson.dumps(payload), headers={'Content-Type': 'application/json'}, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise type(e)(f"{type(e).__name__} while contacting {urlsplit(url).hostname}") from e
+    if not response.ok:
+        # Same as raise_for_status(), minus the URL
+        raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+    return orjson.loads(response.content)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_live_weather(api_key, lat, lon):
+    return _fetch_json(f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}")
+
+def get_live_weather(weather_future):
+    try:
+        response = weather_future.result()
+        weather = response['weather'][0]
+        code, label = WEATHER_CLEAR if weather['id'] == 800 else WEATHER_GROUPS.get(weather['id'] // 100, WEATHER_CLEAR)
+        return code, f"{label} ({weather['main']})"
+    except Exception: return 0, "Clear ☀️ (default)"
+
+def _search_path(location_name, pincode=None, search_mode=SEARCH_MODE):
+    search_query = f"{location_name}, Gwalior, India"
+    if pincode and len(pincode) == 6 and pincode.isdigit():
+        search_query = f"{location_name}, {pincode}, Gwalior, India"
+    encoded_location = quote(search_query)
+    endpoint = SEARCH_ENDPOINTS[search_mode]
+    return f"/{endpoint}/{encoded_location}.json?lat={GWALIOR_LAT}&lon={GWALIOR_LON}&radius={SEARCH_RADIUS_M}&limit=5"
+
+class BatchSearchError(RuntimeError):
+    """A batch search in which some items failed; carries the whole batch so each item can be reported on its own."""
+    def __init__(self, batch):
+        super().__init__("batch search had failed items")
+        self.batch = batch
+
+# Place coordinates don't go stale, so keep lookups for a day. Memory-only and bounded; the requests-cache layer
+# underneath is what survives restarts.
+@st.cache_data(ttl=86400, max_entries=5000, show_spinner=False)
+def fetch_location_options(api_key, queries, search_mode=SEARCH_MODE):
+    # All (location_name, pincode) lookups go out as one TomTom batch-search request instead of one GET each
+    payload = {'batchItems': [{'query': _search_path(name, pincode, search_mode)} for name, pincode in queries]}
+    batch = _fetch_json(f"https://api.tomtom.com/search/2/batch/sync.json?key={api_key}", payload)
+    # Items fail individually under an HTTP 200; raising keeps a partly failed batch out of the cache
+    if any(item['statusCode'] != 200 for item in batch['batchItems']):
+        raise BatchSearchError(batch)
+    return batch
+
+def get_location_options(search_future, index, location_name):
+    try:
+        # A partly failed batch still holds the other location's results; each item reports its own status below
+        error = search_future.exception()
+        batch = error.batch if isinstance(error, BatchSearchError) else search_future.result()
+        item = batch['batchItems'][index]
+        response = item['response']
+        if item['statusCode'] != 200:
+            raise RuntimeError(response.get('errorText', f"status {item['statusCode']}"))
+        return {res['address']['freeformAddress']: (res['position']['lat'], res['position']['lon'])
+                for res in response['results'] if res.get('dist', 0) <= SEARCH_RADIUS_M}
+    except Exception as e:
+        st.error(f"Error searching for location '{location_name}': {e}")
+    return {}
+
+def decode_polyline(encoded, precision=5):
+    # Vectorized Google encoded-polyline decoder. Each value is a run of 5-bit chunks (ASCII - 63, bit 0x20 set
+    # on all but the last chunk), zigzag-encoded as a delta from the previous lat/lon.
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    is_last = (chunks & 0x20) == 0
+    starts = np.flatnonzero(np.concatenate(([True], is_last[:-1])))
+    value_id = np.cumsum(np.concatenate(([0], is_last[:-1])))
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_id])
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_route(api_key, start_coords, end_coords, mode='car'):
+    (start_lat, start_lon), (end_lat, end_lon) = start_coords, end_coords
+    return _fetch_json(f"https://api.tomtom.com/routing/1/calculateRoute/{start_lat},{start_lon}:{end_lat},{end_lon}/json?key={api_key}&travelMode={mode}&traffic=true&routeType=fastest&routeRepresentation=encodedPolyline")
+
+def get_route_details(route_future, mode='car'):
+    try:
+        response = route_future.result()
+        if 'routes' in response and len(response['routes']) > 0:
+            route = response['routes'][0]
+            summary = route['summary']
+            
+            # --- FIX: Gracefully handle missing traffic data during off-peak hours ---
+            live_time = summary.get('trafficTravelTimeInSeconds', summary.get('travelTimeInSeconds'))
+            base_time = summary.get('travelTimeInSeconds')
+            
+            leg = route['legs'][0]
+            route_geometry = decode_polyline(leg['encodedPolyline'], leg.get('encodedPolylinePrecision', 5))
+            
+            if live_time and base_time:
+                return live_time, base_time, route_geometry
+    except Exception as e:
+        # This will now display the actual API error on the screen for better debugging
+        st.error(f"Error calculating route for '{mode}': {e}")
+    return None, None, None